@@ -0,0 +1,187 @@
+import math
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from starlette.responses import JSONResponse
+from starlette.routing import Match
+
+from caches import TTLCache
+
+ANY_METHOD = "*"
+# Shed requests are told to come back after this many seconds
+OVERLOAD_RETRY_AFTER = 1
+
+
+class RateLimit:
+    # A token bucket holding up to `requests` tokens, refilled at requests/period per second
+    def __init__(self, requests: int, period: float):
+        self.requests = requests
+        self.period = period
+
+    @property
+    def rate(self) -> float:
+        return self.requests / self.period
+
+
+def parse_rate_limits(spec: str) -> Dict[Tuple[str, str], RateLimit]:
+    # "POST /token=10/60, GET /posts=600/60": METHOD PATH=REQUESTS/SECONDS, with the path written as
+    # on the route (e.g. /posts/{post_id}/like) and * for any method
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            route, limit = entry.rsplit("=", 1)
+            method, path = route.split()
+            requests, period = limit.split("/")
+            limits[(method.upper(), path)] = RateLimit(int(requests), float(period))
+        except ValueError:
+            raise ValueError(f"Invalid rate limit: {entry!r}")
+    return limits
+
+
+class RateLimitStore:
+    async def acquire(self, key: str, limit: RateLimit) -> float:
+        # Takes a token; returns 0 when allowed, otherwise the seconds until a token is available
+        raise NotImplementedError
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    # Per-worker buckets. Only touched from the event loop, so a read-modify-write needs no lock.
+    # A bucket left alone for its period is full again, which is the same as having none.
+    def __init__(self, max_keys: int = 100000):
+        self._buckets = TTLCache(max_keys, ttl=float("inf"))
+
+    async def acquire(self, key: str, limit: RateLimit) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key) or (limit.requests, now)
+        tokens = min(limit.requests, tokens + (now - updated_at) * limit.rate)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / limit.rate
+        self._buckets.set(key, (tokens, now), ttl=limit.period)
+        return retry_after
+
+
+class RedisRateLimitStore(RateLimitStore):
+    # Shared by every worker. The bucket update runs as one script on the Redis clock, so workers
+    # neither race each other nor disagree about the time.
+    ACQUIRE_SCRIPT = """
+        local capacity = tonumber(ARGV[1])
+        local rate = tonumber(ARGV[2])
+        local time = redis.call('TIME')
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+        local tokens = tonumber(bucket[1]) or capacity
+        local updated_at = tonumber(bucket[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+        local retry_after = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            retry_after = (1 - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+        redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+        return tostring(retry_after)
+    """
+
+    def __init__(self, redis, prefix: str = "rate-limit:"):
+        self._redis = redis
+        self._prefix = prefix
+        self._acquire = self._redis.register_script(self.ACQUIRE_SCRIPT)
+
+    async def acquire(self, key: str, limit: RateLimit) -> float:
+        # Scripts return numbers as integers, so the fractional wait comes back as a string
+        return float(await self._acquire(keys=[self._prefix + key], args=[limit.requests, limit.rate]))
+
+
+def create_rate_limit_store(backend: str, redis=None) -> RateLimitStore:
+    if backend == "memory":
+        return MemoryRateLimitStore()
+    if backend == "redis":
+        return RedisRateLimitStore(redis)
+    raise ValueError(f"Unknown rate limit backend: {backend}")
+
+
+class AdmissionControl:
+    # ASGI middleware that decides whether a request is let in at all, before its body is read or a
+    # database connection is taken:
+    # - 503 when this worker already has max_in_flight requests running, or more than
+    #   max_pool_waiters callers are queued for a database connection, so excess load is shed
+    #   instead of queueing until everything times out
+    # - 429 when the caller's token bucket for the route is empty
+    # Both carry Retry-After. A threshold of 0 turns that check off.
+    def __init__(
+        self,
+        app,
+        routes: Iterable,
+        limits: Dict[Tuple[str, str], RateLimit],
+        store: RateLimitStore,
+        identify: Callable[[dict], str],
+        max_in_flight: int = 0,
+        max_pool_waiters: int = 0,
+        pool_waiters: Callable[[], int] = lambda: 0,
+        exempt_paths: Iterable[str] = (),
+        on_reject: Optional[Callable[[str], None]] = None,
+    ):
+        self.app = app
+        self.routes = routes
+        self.limits = limits
+        self.store = store
+        self.identify = identify
+        self.max_in_flight = max_in_flight
+        self.max_pool_waiters = max_pool_waiters
+        self.pool_waiters = pool_waiters
+        self.exempt_paths = set(exempt_paths)
+        self.on_reject = on_reject
+        self.in_flight = 0
+        self._limited_routes: Optional[List] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            await self._reject(scope, receive, send, "in_flight", 503, OVERLOAD_RETRY_AFTER)
+            return
+        if self.max_pool_waiters and self.pool_waiters() >= self.max_pool_waiters:
+            await self._reject(scope, receive, send, "pool_waiters", 503, OVERLOAD_RETRY_AFTER)
+            return
+
+        route_path = self.limited_route(scope)
+        if route_path is not None:
+            limit = self.limits.get((scope["method"], route_path)) or self.limits[(ANY_METHOD, route_path)]
+            retry_after = await self.store.acquire(f"{scope['method']} {route_path}|{self.identify(scope)}", limit)
+            if retry_after > 0:
+                await self._reject(scope, receive, send, "rate_limited", 429, math.ceil(retry_after))
+                return
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    def limited_route(self, scope) -> Optional[str]:
+        # The path template of the route this request will be routed to, if that route has a limit.
+        # Routes are only complete once the app is running, so the limited ones are picked out lazily.
+        if not self.limits:
+            return None
+        if self._limited_routes is None:
+            paths = {path for _, path in self.limits}
+            self._limited_routes = [route for route in self.routes if getattr(route, "path", None) in paths]
+        method = scope["method"]
+        for route in self._limited_routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL and ((method, route.path) in self.limits or (ANY_METHOD, route.path) in self.limits):
+                return route.path
+        return None
+
+    async def _reject(self, scope, receive, send, reason: str, status_code: int, retry_after: int) -> None:
+        if self.on_reject is not None:
+            self.on_reject(reason)
+        detail = "Too many requests" if status_code == 429 else "Server is busy, please try again shortly"
+        response = JSONResponse({"detail": detail}, status_code=status_code, headers={"Retry-After": str(retry_after)})
+        await response(scope, receive, send)
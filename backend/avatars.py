@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import io
+import os
+import re
+import uuid
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+import aiofiles
+import aiofiles.os
+import magic
+from fastapi import UploadFile
+from PIL import Image, ImageOps
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+ALLOWED_TYPES = ("image/jpeg", "image/png", "image/gif")
+CHUNK_SIZE = 64 * 1024
+DIGEST_LENGTH = 32
+# Avatar files are named <sha256 prefix>.<ext>; anything else in uploads/ predates content addressing
+CONTENT_ADDRESSED_NAME = re.compile(rf"^([0-9a-f]{{{DIGEST_LENGTH}}})\.(?:png|jpg)$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class AvatarTooLarge(Exception):
+    pass
+
+
+class InvalidAvatar(Exception):
+    pass
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+# Module-level so it can be shipped to a process pool
+def _make_thumbnail(source_path: str, size: int) -> Tuple[bytes, str]:
+    # Square, centre-cropped and re-encoded, which also drops EXIF and any trailing data
+    with warnings.catch_warnings():
+        # Pillow only warns about images between its pixel limit and twice that; refuse those too
+        warnings.simplefilter("error", Image.DecompressionBombWarning)
+        with Image.open(source_path) as image:
+            image = ImageOps.exif_transpose(image)
+            has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+            thumbnail = ImageOps.fit(image.convert("RGBA" if has_alpha else "RGB"), (size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    if has_alpha:
+        thumbnail.save(buffer, "PNG", optimize=True)
+        return buffer.getvalue(), "png"
+    thumbnail.save(buffer, "JPEG", quality=85, optimize=True)
+    return buffer.getvalue(), "jpg"
+
+
+class AvatarStore:
+    # Streams uploads to disk with async file I/O under a size cap, renders a fixed-size thumbnail
+    # in a process pool and stores it under its content hash, so a URL never changes meaning
+    def __init__(self, directory: Path, max_bytes: int = 5 * 1024 * 1024, size: int = 256, workers: int = 2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = size
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+
+    async def save(self, upload: UploadFile) -> str:
+        # Returns the stored file name
+        upload_path = self.directory / f".upload-{uuid.uuid4().hex}"
+        try:
+            await self._receive(upload, upload_path)
+            try:
+                data, extension = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, _make_thumbnail, str(upload_path), self.size
+                )
+            # Malformed files surface from Pillow's decoders as any of these
+            except (OSError, SyntaxError, ValueError, Image.DecompressionBombError, Image.DecompressionBombWarning):
+                raise InvalidAvatar("The image could not be read")
+        finally:
+            await self._discard(upload_path)
+        file_name = f"{hashlib.sha256(data).hexdigest()[:DIGEST_LENGTH]}.{extension}"
+        # Written under a temporary name and renamed, so readers never see a partial file
+        partial_path = self.directory / f".partial-{uuid.uuid4().hex}"
+        async with aiofiles.open(partial_path, "wb") as out:
+            await out.write(data)
+        await aiofiles.os.rename(partial_path, self.directory / file_name)
+        return file_name
+
+    async def remove(self, file_name: str) -> None:
+        await self._discard(self.directory / Path(file_name).name)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    async def _receive(self, upload: UploadFile, path: Path) -> None:
+        received = 0
+        async with aiofiles.open(path, "wb") as out:
+            while True:
+                chunk = await upload.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if received == 0 and magic.from_buffer(chunk, mime=True) not in ALLOWED_TYPES:
+                    raise InvalidAvatar("Invalid file type. Only JPEG, PNG, and GIF images are allowed.")
+                received += len(chunk)
+                if received > self.max_bytes:
+                    raise AvatarTooLarge()
+                await out.write(chunk)
+        if received == 0:
+            raise InvalidAvatar("Empty file")
+
+    @staticmethod
+    async def _discard(path: Path) -> None:
+        try:
+            await aiofiles.os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class UploadFiles(StaticFiles):
+    # Content-addressed files are served as immutable, with their hash as the ETag
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        match = CONTENT_ADDRESSED_NAME.match(os.path.basename(full_path))
+        if match is None:
+            return super().file_response(full_path, stat_result, scope, status_code)
+        headers = {"cache-control": IMMUTABLE_CACHE_CONTROL, "etag": f'"{match.group(1)}"'}
+        response = FileResponse(full_path, status_code=status_code, headers=headers, stat_result=stat_result, method=scope["method"])
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+class UploadSizeLimit:
+    # ASGI middleware that refuses oversized request bodies on the given paths before they are
+    # spooled and parsed as a form: up front from Content-Length, or, for chunked bodies, as soon as
+    # more than max_bytes have arrived. AvatarStore still enforces the limit on the file itself.
+    def __init__(self, app, paths: Iterable[str], max_bytes: int):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        content_length: Optional[str] = Headers(scope=scope).get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        response_started = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # The app turns errors while parsing the body into a 400, which is dropped below
+                    if not response_started:
+                        rejected = True
+                        await self._reject(scope, receive, send)
+                    raise UploadTooLarge()
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if rejected:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except UploadTooLarge:
+            if not rejected:
+                raise
+
+    @staticmethod
+    async def _reject(scope, receive, send) -> None:
+        response = JSONResponse({"detail": "Upload too large"}, status_code=413)
+        await response(scope, receive, send)
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import logging
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Events are JSON-serialisable dicts. Every worker subscribes once and hands each event
+# to a local handler, which delivers it to the sockets that worker holds.
+EventHandler = Callable[[dict], None]
+
+
+class Backplane:
+    async def start(self, handler: EventHandler) -> None:
+        raise NotImplementedError
+
+    async def stop(self) -> None:
+        raise NotImplementedError
+
+    async def publish(self, event: dict) -> None:
+        raise NotImplementedError
+
+
+class MemoryBackplane(Backplane):
+    # Single-process stand-in: publishing is a direct call to the local handler
+    def __init__(self):
+        self._handler: Optional[EventHandler] = None
+
+    async def start(self, handler: EventHandler) -> None:
+        self._handler = handler
+
+    async def stop(self) -> None:
+        self._handler = None
+
+    async def publish(self, event: dict) -> None:
+        if self._handler is not None:
+            self._handler(event)
+
+
+class RedisBackplane(Backplane):
+    # The client is shared with the other stores, so it is left for its owner to close
+    def __init__(self, redis, channel: str = "realtime", retry_interval: float = 1.0):
+        self._redis = redis
+        self._channel = channel
+        self._retry_interval = retry_interval
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self, handler: EventHandler) -> None:
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self._channel)
+        self._listener = asyncio.get_running_loop().create_task(self._listen(handler))
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+
+    async def publish(self, event: dict) -> None:
+        await self._redis.publish(self._channel, json.dumps(event, default=str))
+
+    async def _listen(self, handler: EventHandler) -> None:
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    if message is None or message["type"] != "message":
+                        continue
+                    try:
+                        handler(json.loads(message["data"]))
+                    except Exception:
+                        logger.exception("Failed to deliver realtime event")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # The connection dropped; redis-py resubscribes when it reconnects
+                logger.exception("Realtime subscription lost, retrying")
+                await asyncio.sleep(self._retry_interval)
+
+
+def create_backplane(backend: str, redis=None, channel: str = "realtime") -> Backplane:
+    if backend == "memory":
+        return MemoryBackplane()
+    if backend == "redis":
+        return RedisBackplane(redis, channel)
+    raise ValueError(f"Unknown realtime backend: {backend}")
@@ -0,0 +1,467 @@
+# Seeds a database with synthetic users, posts, likes, retweets and messages, then drives the main
+# endpoints concurrently through an in-process ASGI client and reports latency percentiles, throughput
+# and SQL statements per request. Results are written as JSON so runs can be compared between commits.
+#
+#   cd backend
+#   pip install httpx
+#   python benchmark.py --users 2000 --posts 20000 --output bench-before.json
+#   python benchmark.py --users 2000 --posts 20000 --output bench-after.json --compare bench-before.json
+#
+# The app is configured from the usual environment variables (DATABASE_MODE, TIMELINE_BACKEND, ...).
+# --database-url defaults to benchmark.db, a SQLite file that is recreated on every run; DATABASE_URL is
+# deliberately not used. Any other database is only seeded when it is empty, or after dropping every
+# table when --reset is given.
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import bcrypt
+
+WORDS = (
+    "coffee morning build ship deploy review garden city river mountain music guitar piano movie book "
+    "travel train weekend friends family dinner pizza pasta recipe run swim bike park dog cat bird "
+    "sunset rain snow summer winter spring autumn code python database cache latency network server "
+    "design color photo camera beach ocean forest coast bridge market festival concert game match team"
+).split()
+FIRST_NAMES = "ada alan barbara claude dennis donald edsger frances grace guido john ken linus margaret niklaus radia tim".split()
+LAST_NAMES = "lovelace turing liskov shannon ritchie knuth dijkstra allen hopper rossum backus thompson torvalds hamilton wirth perlman lee".split()
+PASSWORD = "benchmark"
+DEFAULT_DATABASE_URL = "sqlite:///benchmark.db"
+SCENARIOS = ("feed", "chats", "messages", "user_search", "suggested", "token", "ws_fanout")
+
+# Counts SQL statements for the request running in the current context
+statement_counter: contextvars.ContextVar = contextvars.ContextVar("statement_counter", default=None)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Seed a database and benchmark the API in-process")
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL)
+    parser.add_argument("--reset", action="store_true", help="drop and recreate every table before seeding")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--likes", type=int, default=30000)
+    parser.add_argument("--retweets", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--partners", type=int, default=8, help="conversation partners per user")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--ws-clients", type=int, default=100, help="sockets connected for ws_fanout")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ",".join(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="earlier results file to print deltas against")
+    return parser.parse_args()
+
+
+def import_app(args: argparse.Namespace):
+    # main configures itself at import time, so the database has to be chosen first
+    if args.database_url == DEFAULT_DATABASE_URL:
+        path = args.database_url[len("sqlite:///"):]
+        if os.path.exists(path):
+            os.remove(path)
+    os.environ["DATABASE_URL"] = args.database_url
+    # Every request comes from the same few callers, so per-caller limits would only measure 429s
+    os.environ.setdefault("RATE_LIMITS", "")
+    import main
+
+    if args.reset and args.database_url != DEFAULT_DATABASE_URL:
+        main.Base.metadata.drop_all(bind=main.engine)
+        with main.engine.connect() as connection:
+            main.Base.metadata.create_all(bind=connection)
+            if main.engine.dialect.name == "postgresql":
+                main.SqlUserSearch.ensure_postgres_indexes(connection)
+                main.SqlPostSearch.ensure_postgres_indexes(connection)
+    return main
+
+
+def insert_rows(main, table, rows: List[dict], batch_size: int = 5000) -> None:
+    with main.engine.begin() as connection:
+        for start in range(0, len(rows), batch_size):
+            connection.execute(table.insert(), rows[start:start + batch_size])
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def seed(main, args: argparse.Namespace, rng: random.Random) -> Dict[str, int]:
+    with main.SessionLocal() as db:
+        if db.query(main.User.id).first() is not None:
+            raise SystemExit("The database already has users; pass --reset to drop and reseed it")
+
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    # Every user shares one password hash, computed at the app's cost factor so /token is realistic
+    hashed_password = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(main.BCRYPT_ROUNDS)).decode()
+    insert_rows(main, main.User.__table__, [
+        {
+            "username": f"user{i}",
+            "email": f"user{i}@example.com",
+            "hashed_password": hashed_password,
+            "first_name": rng.choice(FIRST_NAMES).title(),
+            "last_name": rng.choice(LAST_NAMES).title(),
+            "date_of_birth": (datetime(1970, 1, 1) + timedelta(days=rng.randrange(15000))).date(),
+            "created_at": now,
+            "updated_at": now,
+        }
+        for i in range(args.users)
+    ])
+    with main.SessionLocal() as db:
+        user_ids = [user_id for (user_id,) in db.query(main.User.id).order_by(main.User.id)]
+
+    # Posts are spread over the last 30 days, oldest first so ids follow created_at
+    span = timedelta(days=30)
+    post_rows = []
+    for i in range(args.posts):
+        created_at = now - span + span * i / max(args.posts, 1)
+        post_rows.append({
+            "content": sentence(rng, rng.randint(4, 20)),
+            "user_id": rng.choice(user_ids),
+            "created_at": created_at,
+            "updated_at": created_at,
+            "like_count": 0,
+            "retweet_count": 0,
+        })
+    insert_rows(main, main.Post.__table__, post_rows)
+    with main.SessionLocal() as db:
+        posts = db.query(main.Post.id, main.Post.user_id).order_by(main.Post.id).all()
+
+    like_counts: Dict[int, int] = {}
+    liked = set()
+    for _ in range(args.likes):
+        user_id, (post_id, _) = rng.choice(user_ids), rng.choice(posts)
+        if (user_id, post_id) not in liked:
+            liked.add((user_id, post_id))
+            like_counts[post_id] = like_counts.get(post_id, 0) + 1
+    insert_rows(main, main.Like.__table__, [{"user_id": user_id, "post_id": post_id} for user_id, post_id in liked])
+
+    retweet_counts: Dict[int, int] = {}
+    retweeted = set()
+    retweet_rows = []
+    for _ in range(args.retweets):
+        user_id, (post_id, author_id) = rng.choice(user_ids), rng.choice(posts)
+        if user_id != author_id and (user_id, post_id) not in retweeted:
+            retweeted.add((user_id, post_id))
+            retweet_counts[post_id] = retweet_counts.get(post_id, 0) + 1
+            retweet_rows.append({
+                "user_id": user_id,
+                "original_post_id": post_id,
+                "created_at": now,
+                "updated_at": now,
+                "like_count": 0,
+                "retweet_count": 0,
+            })
+    insert_rows(main, main.Post.__table__, retweet_rows)
+    with main.engine.begin() as connection:
+        for post_id in set(like_counts) | set(retweet_counts):
+            connection.execute(
+                main.Post.__table__.update().where(main.Post.__table__.c.id == post_id),
+                {"like_count": like_counts.get(post_id, 0), "retweet_count": retweet_counts.get(post_id, 0)},
+            )
+
+    # Each user talks to a handful of partners, so conversations have some depth
+    partners = {user_id: rng.sample(user_ids, min(args.partners, len(user_ids))) for user_id in user_ids}
+    message_rows = []
+    for i in range(args.messages):
+        sender_id = rng.choice(user_ids)
+        recipient_id = rng.choice(partners[sender_id])
+        message_rows.append({
+            "content": sentence(rng, rng.randint(2, 12)),
+            "sender_id": sender_id,
+            "recipient_id": recipient_id,
+            "timestamp": now - span + span * i / max(args.messages, 1),
+            "is_read": rng.random() < 0.7,
+        })
+    insert_rows(main, main.Message.__table__, message_rows)
+
+    with main.SessionLocal() as db:
+        main.backfill_conversations(db)
+        # The in-process search indexes were loaded from the empty database at import
+        main.user_search.load(db.query(main.User.id, main.User.username, main.User.first_name, main.User.last_name))
+        main.post_search.load(db.query(main.Post.id, main.Post.content).filter(main.Post.original_post_id.is_(None)))
+
+    return {
+        "users": len(user_ids),
+        "posts": len(posts),
+        "likes": len(liked),
+        "retweets": len(retweet_rows),
+        "messages": len(message_rows),
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def count_statements(*args, **kwargs) -> None:
+    counter = statement_counter.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+async def run_scenario(request: Callable[[int], Awaitable[bool]], total: int, warmup: int, concurrency: int) -> dict:
+    for i in range(warmup):
+        await request(i)
+
+    latencies: List[float] = []
+    statements: List[int] = []
+    errors = 0
+    pending = iter(range(total))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in pending:
+            counter = [0]
+            token = statement_counter.set(counter)
+            started = time.perf_counter()
+            try:
+                ok = await request(warmup + i)
+            except Exception:
+                ok = False
+            finally:
+                statement_counter.reset(token)
+            latencies.append((time.perf_counter() - started) * 1000)
+            statements.append(counter[0])
+            errors += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "concurrency": concurrency,
+        "throughput_rps": round(total / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 2),
+            "p95": round(percentile(latencies, 0.95), 2),
+            "p99": round(percentile(latencies, 0.99), 2),
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+            "max": round(latencies[-1], 2) if latencies else 0.0,
+        },
+        "sql_statements_per_request": round(sum(statements) / len(statements), 2) if statements else 0.0,
+    }
+
+
+class ASGIWebSocket:
+    # Minimal in-process WebSocket client that talks to the app over the ASGI interface
+    def __init__(self, app, path: str, query_string: str):
+        self.app = app
+        self.scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query_string.encode(),
+            "root_path": "",
+            "headers": [(b"host", b"benchmark")],
+            "client": ("127.0.0.1", 0),
+            "server": ("benchmark", 80),
+            "subprotocols": [],
+        }
+        self._to_app: asyncio.Queue = asyncio.Queue()
+        self._from_app: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def connect(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self.app(self.scope, self._to_app.get, self._from_app.put))
+        await self._to_app.put({"type": "websocket.connect"})
+        message = await self._from_app.get()
+        if message["type"] != "websocket.accept":
+            raise RuntimeError(f"WebSocket rejected: {message}")
+
+    async def receive_text(self) -> Optional[str]:
+        message = await self._from_app.get()
+        return message.get("text") if message["type"] == "websocket.send" else None
+
+    async def close(self) -> None:
+        await self._to_app.put({"type": "websocket.disconnect", "code": 1000})
+        if self._task is not None:
+            await asyncio.wait([self._task], timeout=5)
+
+
+async def benchmark(main, args: argparse.Namespace, rng: random.Random, dataset: Dict[str, int]) -> dict:
+    import httpx
+    from sqlalchemy import event
+
+    for engine in filter(None, (main.engine, getattr(getattr(main, "async_engine", None), "sync_engine", None))):
+        event.listen(engine, "before_cursor_execute", count_statements)
+
+    with main.SessionLocal() as db:
+        users = db.query(main.User.id, main.User.username, main.User.first_name).all()
+        pairs = db.query(main.Conversation.user_a_id, main.Conversation.user_b_id).filter(
+            main.Conversation.user_a_id != main.Conversation.user_b_id
+        ).all()
+        post_ids = [post_id for (post_id,) in db.query(main.Post.id).filter(main.Post.original_post_id.is_(None))]
+    usernames = {user_id: username for user_id, username, _ in users}
+
+    def headers_for(user_id: int) -> dict:
+        token = main.create_access_token({"sub": usernames[user_id]}, timedelta(hours=1))
+        return {"Authorization": f"Bearer {token}"}
+
+    auth = {user_id: headers_for(user_id) for user_id in rng.sample(list(usernames), min(200, len(usernames)))}
+    auth_ids = list(auth)
+    search_terms = [value[:3].lower() for _, username, first_name in users for value in (username, first_name)]
+    conversation_pairs = [pair for pair in pairs if pair[0] in auth] or pairs
+
+    await main.app.router.startup()
+    results = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://benchmark") as client:
+
+        async def feed(i: int) -> bool:
+            params = {"limit": 20}
+            if i % 2 and post_ids:
+                params["before_id"] = rng.choice(post_ids)
+            return (await client.get("/posts", params=params, headers=auth[rng.choice(auth_ids)])).status_code == 200
+
+        async def chats(i: int) -> bool:
+            return (await client.get("/chats", headers=auth[rng.choice(auth_ids)])).status_code == 200
+
+        async def messages(i: int) -> bool:
+            user_id, partner_id = rng.choice(conversation_pairs)
+            headers = auth.get(user_id) or headers_for(user_id)
+            return (await client.get(f"/messages/{partner_id}", headers=headers)).status_code == 200
+
+        async def user_search(i: int) -> bool:
+            params = {"query": rng.choice(search_terms)}
+            return (await client.get("/users/search", params=params, headers=auth[rng.choice(auth_ids)])).status_code == 200
+
+        async def suggested(i: int) -> bool:
+            return (await client.get("/suggested", headers=auth[rng.choice(auth_ids)])).status_code == 200
+
+        async def token(i: int) -> bool:
+            form = {"username": usernames[rng.choice(auth_ids)], "password": PASSWORD}
+            return (await client.post("/token", data=form)).status_code == 200
+
+        requests = {"feed": feed, "chats": chats, "messages": messages, "user_search": user_search, "suggested": suggested, "token": token}
+        for name in args.scenarios.split(","):
+            if name in requests:
+                print(f"running {name} ...", file=sys.stderr)
+                results[name] = await run_scenario(requests[name], args.requests, args.warmup, args.concurrency)
+
+        if "ws_fanout" in args.scenarios.split(","):
+            print("running ws_fanout ...", file=sys.stderr)
+            results["ws_fanout"] = await ws_fanout(main, client, args, rng, auth, post_ids)
+
+    await main.app.router.shutdown()
+    return results
+
+
+async def ws_fanout(main, client, args: argparse.Namespace, rng: random.Random, auth: Dict[int, dict], post_ids: List[int]) -> dict:
+    # Each request likes a different post; it completes once every connected socket has received
+    # the resulting post_counters broadcast, so the latency covers the whole fan-out
+    sockets = []
+    auth_ids = list(auth)
+    for i in range(args.ws_clients):
+        token = auth[auth_ids[i % len(auth_ids)]]["Authorization"].split(" ", 1)[1]
+        socket = ASGIWebSocket(main.app, "/ws", f"token={token}")
+        await socket.connect()
+        sockets.append(socket)
+
+    waiting: Dict[int, list] = {}
+
+    async def read(socket: ASGIWebSocket) -> None:
+        while True:
+            text = await socket.receive_text()
+            if text is None:
+                continue
+            event = json.loads(text)
+            if event.get("type") == "post_counters" and event["post_id"] in waiting:
+                waiter = waiting[event["post_id"]]
+                waiter[0] -= 1
+                if waiter[0] == 0:
+                    waiter[1].set()
+
+    readers = [asyncio.get_running_loop().create_task(read(socket)) for socket in sockets]
+    targets = rng.sample(post_ids, min(len(post_ids), args.requests + args.warmup))
+
+    async def like(i: int) -> bool:
+        post_id = targets[i % len(targets)]
+        waiter = waiting[post_id] = [len(sockets), asyncio.Event()]
+        response = await client.post(f"/posts/{post_id}/like", headers=auth[rng.choice(auth_ids)])
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout=10)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiting.pop(post_id, None)
+        return response.status_code == 200
+
+    try:
+        result = await run_scenario(like, min(args.requests, len(targets) - args.warmup), args.warmup, args.concurrency)
+        result["sockets"] = len(sockets)
+        return result
+    finally:
+        for reader in readers:
+            reader.cancel()
+        for socket in sockets:
+            await socket.close()
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report: dict, previous: Optional[dict]) -> None:
+    print(f"{'scenario':<12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'sql/req':>8} {'errors':>7}")
+    for name, result in report["results"].items():
+        latency = result["latency_ms"]
+        line = (
+            f"{name:<12} {latency['p50']:>9} {latency['p95']:>9} {latency['p99']:>9} "
+            f"{result['throughput_rps']:>8} {result['sql_statements_per_request']:>8} {result['errors']:>7}"
+        )
+        earlier = (previous or {}).get("results", {}).get(name)
+        if earlier:
+            p95_change = latency["p95"] - earlier["latency_ms"]["p95"]
+            sql_change = result["sql_statements_per_request"] - earlier["sql_statements_per_request"]
+            line += f"   p95 {p95_change:+.2f} ms, sql {sql_change:+.2f} vs {previous.get('commit') or 'previous'}"
+        print(line)
+
+
+def main_cli() -> None:
+    args = parse_args()
+    rng = random.Random(args.seed)
+    app_module = import_app(args)
+    print("seeding ...", file=sys.stderr)
+    dataset = seed(app_module, args, rng)
+    results = asyncio.run(benchmark(app_module, args, rng, dataset))
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "database": app_module.engine.dialect.name,
+        "database_mode": app_module.DATABASE_MODE,
+        "dataset": dataset,
+        "settings": {"requests": args.requests, "warmup": args.warmup, "concurrency": args.concurrency, "seed": args.seed},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_report(report, previous)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,150 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+
+class TTLCache:
+    # Bounded LRU whose entries also expire after a time-to-live
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def _store(self, key: Hashable, value: Any, ttl: float) -> None:
+        # Called with the lock held
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        self._added(key)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    # Called with the lock held; subclasses use these to keep secondary indexes in step
+    def _added(self, key: Hashable) -> None:
+        pass
+
+    def _remove(self, key: Hashable) -> None:
+        del self._entries[key]
+
+
+class PrincipalCache(TTLCache):
+    # Authenticated user snapshots keyed by (token subject, token hash), invalidated per subject. As in
+    # PostCache, a fill carries the generation seen before the user was loaded and is dropped if an
+    # invalidation happened in between.
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        super().__init__(max_size, ttl)
+        self.generation = 0
+        self._keys_by_subject: Dict[str, Set[Tuple[str, str]]] = {}
+
+    @staticmethod
+    def key(subject: str, token: str) -> Tuple[str, str]:
+        return subject, hashlib.sha256(token.encode()).hexdigest()
+
+    def fill(self, key: Tuple[str, str], value: Any, generation: int, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            if generation == self.generation:
+                self._store(key, value, ttl)
+
+    def invalidate(self, subject: str) -> None:
+        with self._lock:
+            self.generation += 1
+            for key in list(self._keys_by_subject.get(subject, ())):
+                self._remove(key)
+
+    def _added(self, key: Tuple[str, str]) -> None:
+        self._keys_by_subject.setdefault(key[0], set()).add(key)
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        super()._remove(key)
+        subject_keys = self._keys_by_subject.get(key[0])
+        if subject_keys is not None:
+            subject_keys.discard(key)
+            if not subject_keys:
+                del self._keys_by_subject[key[0]]
+
+
+class PostCache(TTLCache):
+    # Snapshots of the posts retweets point at, keyed by post id, so a feed page full of retweets of
+    # one post reads it once. Fills carry the generation seen before the database was queried; a fill
+    # that raced with an invalidation is dropped, so it can't put back what was just invalidated.
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        super().__init__(max_size, ttl)
+        self.generation = 0
+        self._keys_by_author: Dict[int, Set[int]] = {}
+
+    def get_many(self, post_ids: Iterable[int]) -> Tuple[Dict[int, Any], int]:
+        with self._lock:
+            generation = self.generation
+        found = {}
+        for post_id in post_ids:
+            entry = self.get(post_id)
+            if entry is not None:
+                found[post_id] = entry[1]
+        return found, generation
+
+    def fill(self, entries: Iterable[Tuple[int, int, Any]], generation: int) -> None:
+        # entries are (post id, author id, snapshot)
+        with self._lock:
+            if generation != self.generation:
+                return
+            for post_id, author_id, snapshot in entries:
+                self._store(post_id, (author_id, snapshot), self.ttl)
+
+    def invalidate_author(self, author_id: int) -> None:
+        # Snapshots embed their author, so a change to the author drops all of their posts
+        with self._lock:
+            self.generation += 1
+            for post_id in list(self._keys_by_author.get(author_id, ())):
+                self._remove(post_id)
+
+    def _added(self, key: int) -> None:
+        self._keys_by_author.setdefault(self._entries[key][1][0], set()).add(key)
+
+    def _remove(self, key: int) -> None:
+        author_id = self._entries[key][1][0]
+        super()._remove(key)
+        author_keys = self._keys_by_author.get(author_id)
+        if author_keys is not None:
+            author_keys.discard(key)
+            if not author_keys:
+                del self._keys_by_author[author_id]
@@ -0,0 +1,56 @@
+import threading
+from collections import defaultdict
+from typing import Dict, Tuple
+
+
+class CounterBuffer:
+    # Accumulates counter deltas per (post id, column) so bursts on hot posts become one
+    # UPDATE per flush interval. An interval of 0 disables buffering (write-through).
+    def __init__(self, flush_interval: float = 0.0):
+        self.flush_interval = flush_interval
+        self._deltas: Dict[Tuple[int, str], int] = defaultdict(int)
+        # Drained but not yet committed; still counted by pending() so reads never dip mid-flush
+        self._inflight: Dict[Tuple[int, str], int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.flush_interval > 0
+
+    def add(self, post_id: int, column: str, delta: int) -> None:
+        with self._lock:
+            self._deltas[(post_id, column)] += delta
+
+    def pending(self, post_id: int, column: str) -> int:
+        key = (post_id, column)
+        with self._lock:
+            return self._deltas.get(key, 0) + self._inflight.get(key, 0)
+
+    def drain(self) -> Dict[int, Dict[str, int]]:
+        # Returns {post_id: {column: delta}} to write; call complete() or restore() afterwards
+        with self._lock:
+            deltas, self._deltas = self._deltas, defaultdict(int)
+            by_post: Dict[int, Dict[str, int]] = defaultdict(dict)
+            for (post_id, column), delta in deltas.items():
+                if delta:
+                    self._inflight[(post_id, column)] += delta
+                    by_post[post_id][column] = delta
+        return dict(by_post)
+
+    def complete(self, by_post: Dict[int, Dict[str, int]]) -> None:
+        self._settle(by_post, restore=False)
+
+    def restore(self, by_post: Dict[int, Dict[str, int]]) -> None:
+        # Puts back deltas from a flush that failed
+        self._settle(by_post, restore=True)
+
+    def _settle(self, by_post: Dict[int, Dict[str, int]], restore: bool) -> None:
+        with self._lock:
+            for post_id, columns in by_post.items():
+                for column, delta in columns.items():
+                    key = (post_id, column)
+                    self._inflight[key] -= delta
+                    if not self._inflight[key]:
+                        del self._inflight[key]
+                    if restore:
+                        self._deltas[key] += delta
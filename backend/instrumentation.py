@@ -0,0 +1,270 @@
+import contextvars
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from starlette.datastructures import Headers, MutableHeaders
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Slow statements are logged without their parameters, cut to this many characters
+SLOW_QUERY_LOG_LENGTH = 1000
+PROFILE_HEADER = "x-profile"
+UNMATCHED_ROUTE = "unmatched"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...], labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.labels = labels
+        # Per label set: a count for each bucket (not cumulative) plus the +Inf bucket, then the sum
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    bucket_label = f'le="{le}"'
+                    lines.append(f"{self.name}_bucket{format_labels(self.labels, label_values, bucket_label)} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, label_values)} {series[-1]}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    # Read when the metrics are scraped, so it never drifts from the value it reports
+    def __init__(self, name: str, help_text: str, read: Callable[[], float]):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+class RequestProfile:
+    # Filled in by the engine hooks while a request runs. The same object is shared with the
+    # threadpool workers the request's queries run on, since they copy the request's context.
+    __slots__ = ("started_at", "statements", "db_seconds", "pool_wait_seconds")
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+
+    def server_timing(self) -> str:
+        total = time.perf_counter() - self.started_at
+        app = max(total - self.db_seconds - self.pool_wait_seconds, 0.0)
+        return (
+            f'db;dur={self.db_seconds * 1000:.2f};desc="{self.statements} statements", '
+            f"pool;dur={self.pool_wait_seconds * 1000:.2f}, app;dur={app * 1000:.2f}, total;dur={total * 1000:.2f}"
+        )
+
+
+current_profile: contextvars.ContextVar = contextvars.ContextVar("current_profile", default=None)
+
+
+class Instrumentation:
+    # Process-local metrics; with several workers each one is scraped separately
+    def __init__(self, slow_query_seconds: float = 0.2):
+        self.slow_query_seconds = slow_query_seconds
+        self.request_seconds = Histogram(
+            "http_request_duration_seconds", "Time to handle a request, by route.", LATENCY_BUCKETS, ("method", "route")
+        )
+        self.requests = Counter("http_requests_total", "Requests handled, by route and status.", ("method", "route", "status"))
+        self.request_statements = Histogram(
+            "http_request_db_statements", "SQL statements executed per request, by route.", STATEMENT_BUCKETS, ("method", "route")
+        )
+        self.request_db_seconds = Histogram(
+            "http_request_db_seconds", "Time spent in SQL statements per request, by route.", LATENCY_BUCKETS, ("method", "route")
+        )
+        self.pool_wait_seconds = Histogram(
+            "db_pool_checkout_seconds", "Time spent waiting for a database connection from the pool.", LATENCY_BUCKETS
+        )
+        self.slow_queries = Counter("db_slow_queries_total", "SQL statements slower than the slow query threshold.")
+        self.rejected_requests = Counter(
+            "http_requests_rejected_total", "Requests turned away by admission control, by reason.", ("reason",)
+        )
+        # Callers currently blocked in a pool checkout, across every instrumented engine
+        self.pool_waiters = 0
+        self._pool_waiters_lock = threading.Lock()
+        self._metrics: List = [
+            self.request_seconds, self.requests, self.request_statements, self.request_db_seconds,
+            self.pool_wait_seconds, self.slow_queries, self.rejected_requests,
+            Gauge("db_pool_waiters", "Callers waiting for a database connection from the pool.", lambda: self.pool_waiters),
+        ]
+
+    def add_gauge(self, name: str, help_text: str, read: Callable[[], float]) -> None:
+        self._metrics.append(Gauge(name, help_text, read))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def instrument_engine(self, engine) -> None:
+        # For an AsyncEngine pass its sync_engine; the events fire there either way
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(engine, "handle_error", self._handle_error)
+
+    def pool_class(self, url: str) -> type:
+        # Pools have no event before a checkout starts, so the wait is timed around connect() on a
+        # subclass of the pool the dialect would pick for url. Passed to the engine as poolclass, it
+        # also covers the pools the engine recreates on dispose() or after a disconnect.
+        url = make_url(url)
+        instrumentation = self
+
+        class TimedPool(url.get_dialect().get_pool_class(url)):
+            def connect(self):
+                return instrumentation._timed_checkout(super().connect)
+
+        return TimedPool
+
+    def _timed_checkout(self, connect: Callable):
+        started = time.perf_counter()
+        with self._pool_waiters_lock:
+            self.pool_waiters += 1
+        try:
+            return connect()
+        finally:
+            with self._pool_waiters_lock:
+                self.pool_waiters -= 1
+            waited = time.perf_counter() - started
+            self.pool_wait_seconds.observe(waited)
+            profile = current_profile.get()
+            if profile is not None:
+                profile.pool_wait_seconds += waited
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        conn.info.setdefault("statement_started_at", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        elapsed = time.perf_counter() - conn.info["statement_started_at"].pop()
+        profile = current_profile.get()
+        if profile is not None:
+            profile.statements += 1
+            profile.db_seconds += elapsed
+        if 0 < self.slow_query_seconds <= elapsed:
+            self.slow_queries.inc()
+            logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, " ".join(statement.split())[:SLOW_QUERY_LOG_LENGTH])
+
+    @staticmethod
+    def _handle_error(context) -> None:
+        # A failed statement never reaches after_cursor_execute
+        started_at = context.connection.info.get("statement_started_at") if context.connection is not None else None
+        if started_at:
+            started_at.pop()
+
+
+class RequestMetrics:
+    # ASGI middleware recording latency and database work per route. Routes are labelled by their
+    # path template, so /users/1 and /users/2 share a series. When profiling is enabled, a request
+    # sent with "X-Profile: 1" gets a Server-Timing header breaking its time down; for a streamed
+    # response that covers only the work done before the first byte.
+    def __init__(self, app, instrumentation: Instrumentation, routes: Iterable, profiling: bool = False):
+        self.app = app
+        self.instrumentation = instrumentation
+        self.routes = routes
+        self.profiling = profiling
+        self._route_paths: Dict[object, str] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        profiled = self.profiling and Headers(scope=scope).get(PROFILE_HEADER) == "1"
+        status_code = 500
+
+        async def send_with_metrics(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if profiled:
+                    MutableHeaders(scope=message).append("server-timing", profile.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            current_profile.reset(token)
+            route = self.route_path(scope.get("endpoint"))
+            method = scope["method"]
+            self.instrumentation.request_seconds.observe(time.perf_counter() - profile.started_at, method, route)
+            self.instrumentation.requests.inc(method, route, str(status_code))
+            self.instrumentation.request_statements.observe(profile.statements, method, route)
+            self.instrumentation.request_db_seconds.observe(profile.db_seconds, method, route)
+
+    def route_path(self, endpoint: Optional[object]) -> str:
+        # The router leaves the matched endpoint in the scope; mounts record their app instead
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            for route in self.routes:
+                if getattr(route, "endpoint", None) is endpoint or getattr(route, "app", None) is endpoint:
+                    path = route.path
+                    break
+            else:
+                path = UNMATCHED_ROUTE
+            self._route_paths[endpoint] = path
+        return path
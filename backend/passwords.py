@@ -0,0 +1,58 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+import bcrypt
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+# Module-level so they can be shipped to a process pool
+def _hash(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _verify(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+class PasswordHasher:
+    # Runs bcrypt on a dedicated, size-limited pool so the event loop never does the work.
+    # At most max_pending calls may be running or queued; beyond that callers get PasswordHasherBusy.
+    def __init__(self, rounds: int = 12, workers: int = 2, max_pending: int = 16, use_processes: bool = False):
+        self.rounds = rounds
+        self.max_pending = max_pending
+        self._executor: Executor = (ProcessPoolExecutor if use_processes else ThreadPoolExecutor)(max_workers=workers)
+        self._pending = 0
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._submit(_hash, password.encode(), self.rounds)
+        return hashed.decode()
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._submit(_verify, password.encode(), hashed.encode())
+
+    def needs_rehash(self, hashed: str) -> bool:
+        # bcrypt hashes look like $2b$<rounds>$<salt+hash>
+        return self.hash_rounds(hashed) != self.rounds
+
+    @staticmethod
+    def hash_rounds(hashed: str) -> Optional[int]:
+        try:
+            return int(hashed.split("$")[2])
+        except (IndexError, ValueError):
+            return None
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    async def _submit(self, fn, *args):
+        if self._pending >= self.max_pending:
+            raise PasswordHasherBusy()
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
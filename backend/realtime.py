@@ -0,0 +1,80 @@
+import asyncio
+from typing import Dict, List, Set
+
+from fastapi import WebSocket, status
+
+
+class Connection:
+    # One socket plus its bounded outbound queue, drained by a dedicated writer task
+    def __init__(self, user_id: int, websocket: WebSocket, queue_size: int):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: asyncio.Task = None
+
+
+class ConnectionManager:
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.connections: Dict[int, Set[Connection]] = {}
+
+    async def connect(self, user_id: int, websocket: WebSocket) -> Connection:
+        await websocket.accept()
+        connection = Connection(user_id, websocket, self.queue_size)
+        connection.writer = asyncio.get_running_loop().create_task(self._write(connection))
+        self.connections.setdefault(user_id, set()).add(connection)
+        return connection
+
+    async def disconnect(self, connection: Connection) -> None:
+        user_connections = self.connections.get(connection.user_id)
+        if user_connections is not None:
+            user_connections.discard(connection)
+            if not user_connections:
+                del self.connections[connection.user_id]
+        if connection.writer is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+
+    def send_to_user(self, user_id: int, text: str) -> None:
+        # Never waits on a socket: messages are queued and a consumer that falls behind is dropped
+        for connection in list(self.connections.get(user_id, ())):
+            try:
+                connection.queue.put_nowait(text)
+            except asyncio.QueueFull:
+                asyncio.get_running_loop().create_task(self._drop(connection))
+
+    def send_to_users(self, user_ids, text: str) -> None:
+        for user_id in set(user_ids):
+            self.send_to_user(user_id, text)
+
+    def send_to_all(self, text: str) -> None:
+        for user_id in list(self.connections):
+            self.send_to_user(user_id, text)
+
+    def connection_count(self) -> int:
+        return sum(len(user_connections) for user_connections in self.connections.values())
+
+    def queue_depths(self) -> List[int]:
+        # Undelivered messages per socket
+        return [connection.queue.qsize() for user_connections in self.connections.values() for connection in user_connections]
+
+    async def close_all(self) -> None:
+        for user_connections in list(self.connections.values()):
+            for connection in list(user_connections):
+                await self._drop(connection, status.WS_1001_GOING_AWAY)
+
+    async def _write(self, connection: Connection) -> None:
+        try:
+            while True:
+                text = await connection.queue.get()
+                await connection.websocket.send_text(text)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await self.disconnect(connection)
+
+    async def _drop(self, connection: Connection, code: int = status.WS_1013_TRY_AGAIN_LATER) -> None:
+        await self.disconnect(connection)
+        try:
+            await connection.websocket.close(code=code)
+        except Exception:
+            pass
@@ -0,0 +1,48 @@
+from caches import TTLCache
+
+
+# Remembers which users wrote recently, so their reads can go to the primary until the replicas
+# have had time to catch up with their own changes.
+class RecentWriters:
+    def __init__(self, window: float = 5.0):
+        self.window = window
+
+    async def record(self, user_id: int) -> None:
+        raise NotImplementedError
+
+    async def contains(self, user_id: int) -> bool:
+        raise NotImplementedError
+
+
+class MemoryRecentWriters(RecentWriters):
+    def __init__(self, window: float = 5.0, max_users: int = 100000):
+        super().__init__(window)
+        self._writers = TTLCache(max_users, window)
+
+    async def record(self, user_id: int) -> None:
+        self._writers.set(user_id, True)
+
+    async def contains(self, user_id: int) -> bool:
+        return self._writers.get(user_id) is not None
+
+
+class RedisRecentWriters(RecentWriters):
+    # Shared by every worker, so a read after a write is routed correctly whichever worker serves it
+    def __init__(self, redis, window: float = 5.0, prefix: str = "recent-writer:"):
+        super().__init__(window)
+        self._redis = redis
+        self._prefix = prefix
+
+    async def record(self, user_id: int) -> None:
+        await self._redis.set(f"{self._prefix}{user_id}", 1, px=int(self.window * 1000))
+
+    async def contains(self, user_id: int) -> bool:
+        return bool(await self._redis.exists(f"{self._prefix}{user_id}"))
+
+
+def create_recent_writers(backend: str, window: float, redis=None) -> RecentWriters:
+    if backend == "memory":
+        return MemoryRecentWriters(window)
+    if backend == "redis":
+        return RedisRecentWriters(redis, window)
+    raise ValueError(f"Unknown recent writers backend: {backend}")
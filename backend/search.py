@@ -0,0 +1,322 @@
+import html
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, case, func, literal_column, or_, text
+from sqlalchemy.orm import Session
+
+# Relevance tiers, best first: exact username, username prefix, first/last name prefix, substring anywhere
+EXACT_USERNAME, USERNAME_PREFIX, NAME_PREFIX, SUBSTRING = 3, 2, 1, 0
+
+
+def rank_user(query: str, username: str, first_name: str, last_name: str) -> int:
+    query = query.lower()
+    username = (username or "").lower()
+    if username == query:
+        return EXACT_USERNAME
+    if username.startswith(query):
+        return USERNAME_PREFIX
+    if (first_name or "").lower().startswith(query) or (last_name or "").lower().startswith(query):
+        return NAME_PREFIX
+    return SUBSTRING
+
+
+# Cursors are "<rank>:<id>" of the last result returned, so the next page resumes right after it
+def encode_cursor(rank, row_id: int) -> str:
+    return f"{rank}:{row_id}"
+
+
+def decode_cursor(cursor: Optional[str], rank_type=int) -> Optional[Tuple[float, int]]:
+    if not cursor:
+        return None
+    try:
+        rank, row_id = cursor.split(":")
+        return rank_type(rank), int(row_id)
+    except ValueError:
+        raise ValueError("Invalid search cursor")
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class UserSearch:
+    def search(self, db: Session, query: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[int], Optional[str]]:
+        # Returns the matching user ids for one page and the cursor for the next page, if any
+        raise NotImplementedError
+
+    def load(self, rows: Iterable[Tuple[int, str, str, str]]) -> None:
+        pass
+
+    def index(self, user_id: int, username: str, first_name: str, last_name: str) -> None:
+        pass
+
+    def remove(self, user_id: int) -> None:
+        pass
+
+
+class SqlUserSearch(UserSearch):
+    # Ranked ILIKE search in the database. On Postgres the predicates are served by the
+    # trigram GIN indexes created by ensure_postgres_indexes; elsewhere it still works, unindexed.
+    def __init__(self, user_model):
+        self.User = user_model
+
+    def search(self, db: Session, query: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[int], Optional[str]]:
+        User = self.User
+        pattern = f"%{escape_like(query)}%"
+        prefix = f"{escape_like(query)}%"
+        rank = case(
+            (func.lower(User.username) == query.lower(), EXACT_USERNAME),
+            (User.username.ilike(prefix, escape="\\"), USERNAME_PREFIX),
+            (or_(User.first_name.ilike(prefix, escape="\\"), User.last_name.ilike(prefix, escape="\\")), NAME_PREFIX),
+            else_=SUBSTRING,
+        )
+        sql_query = db.query(User.id, rank).filter(or_(
+            User.username.ilike(pattern, escape="\\"),
+            User.first_name.ilike(pattern, escape="\\"),
+            User.last_name.ilike(pattern, escape="\\"),
+        ))
+        after = decode_cursor(cursor)
+        if after is not None:
+            sql_query = sql_query.filter(or_(rank < after[0], and_(rank == after[0], User.id > after[1])))
+        rows = sql_query.order_by(rank.desc(), User.id).limit(limit + 1).all()
+        next_cursor = encode_cursor(rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+        return [user_id for user_id, _ in rows[:limit]], next_cursor
+
+    @staticmethod
+    def ensure_postgres_indexes(connection) -> None:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for column in ("username", "first_name", "last_name"):
+            connection.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_users_{column}_trgm ON users USING gin ({column} gin_trgm_ops)"
+            ))
+
+
+class MemoryUserSearch(UserSearch):
+    # In-process n-gram index for SQLite and tests. Queries shorter than three characters use
+    # n-grams of their own length, so every length down to min_length resolves from the index.
+    def __init__(self, min_length: int = 2):
+        self._gram_sizes = range(max(1, min(min_length, 3)), 4)
+        self._users: Dict[int, Tuple[str, str, str]] = {}
+        self._grams: Dict[str, Set[int]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, rows: Iterable[Tuple[int, str, str, str]]) -> None:
+        for user_id, username, first_name, last_name in rows:
+            self.index(user_id, username, first_name, last_name)
+
+    def index(self, user_id: int, username: str, first_name: str, last_name: str) -> None:
+        with self._lock:
+            self._remove(user_id)
+            fields = (username or "", first_name or "", last_name or "")
+            self._users[user_id] = fields
+            for gram in self._fields_grams(fields):
+                self._grams.setdefault(gram, set()).add(user_id)
+
+    def remove(self, user_id: int) -> None:
+        with self._lock:
+            self._remove(user_id)
+
+    def search(self, db: Session, query: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[int], Optional[str]]:
+        needle = query.lower()
+        size = min(len(needle), 3)
+        with self._lock:
+            candidates: Optional[Set[int]] = None
+            for gram in {needle[i:i + size] for i in range(len(needle) - size + 1)}:
+                matches = self._grams.get(gram, set())
+                candidates = set(matches) if candidates is None else candidates & matches
+                if not candidates:
+                    break
+            ranked = []
+            for user_id in candidates or ():
+                fields = self._users[user_id]
+                if any(needle in field.lower() for field in fields):
+                    ranked.append((rank_user(query, *fields), user_id))
+        ranked.sort(key=lambda item: (-item[0], item[1]))
+        after = decode_cursor(cursor)
+        if after is not None:
+            ranked = [item for item in ranked if (-item[0], item[1]) > (-after[0], after[1])]
+        next_cursor = encode_cursor(*ranked[limit - 1]) if len(ranked) > limit else None
+        return [user_id for _, user_id in ranked[:limit]], next_cursor
+
+    def _fields_grams(self, fields: Tuple[str, str, str]) -> Set[str]:
+        grams = set()
+        for field in fields:
+            field = field.lower()
+            for size in self._gram_sizes:
+                grams.update(field[i:i + size] for i in range(len(field) - size + 1))
+        return grams
+
+    def _remove(self, user_id: int) -> None:
+        fields = self._users.pop(user_id, None)
+        if fields is None:
+            return
+        for gram in self._fields_grams(fields):
+            user_ids = self._grams.get(gram)
+            if user_ids is not None:
+                user_ids.discard(user_id)
+                if not user_ids:
+                    del self._grams[gram]
+
+
+# Post search ranks by relevance, newest first among equals, and marks matched words with <mark>
+TEXT_SEARCH_CONFIG = "english"
+HIGHLIGHT_START, HIGHLIGHT_STOP = "<mark>", "</mark>"
+WORD_RE = re.compile(r"\w+")
+# Highlights are HTML: everything outside the marks is escaped the way html.escape does it
+HTML_ESCAPES = (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ('"', "&quot;"), ("'", "&#x27;"))
+
+
+def escape_html_sql(column):
+    for character, entity in HTML_ESCAPES:
+        column = func.replace(column, character, entity)
+    return column
+
+
+def tokenize(value: str) -> List[str]:
+    return WORD_RE.findall((value or "").lower())
+
+
+class PostSearch:
+    def search(self, db: Session, query: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[Tuple[int, str]], Optional[str]]:
+        # Returns (post id, highlighted content) for one page and the cursor for the next page, if any
+        raise NotImplementedError
+
+    def load(self, rows: Iterable[Tuple[int, str]]) -> None:
+        pass
+
+    def index(self, post_id: int, content: str) -> None:
+        pass
+
+    def remove(self, post_id: int) -> None:
+        pass
+
+
+class SqlPostSearch(PostSearch):
+    # Postgres full-text search over a generated tsvector column, so every insert keeps it current.
+    # The GIN index is partial: retweets have no content of their own and are never searched.
+    HEADLINE_OPTIONS = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxFragments=2, MaxWords=30, MinWords=10"
+
+    def __init__(self, post_model):
+        self.Post = post_model
+
+    def search(self, db: Session, query: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[Tuple[int, str]], Optional[str]]:
+        Post = self.Post
+        config = literal_column(f"'{TEXT_SEARCH_CONFIG}'::regconfig")
+        ts_query = func.websearch_to_tsquery(config, query)
+        vector = literal_column("posts.search_vector")
+        rank = func.ts_rank_cd(vector, ts_query)
+        # Postgres evaluates ts_headline after the LIMIT, so only the returned page is highlighted. The
+        # content is escaped first, so the only markup in a headline is the marks.
+        headline = func.ts_headline(config, escape_html_sql(Post.content), ts_query, self.HEADLINE_OPTIONS)
+        sql_query = db.query(Post.id, rank, headline).filter(Post.original_post_id.is_(None), vector.op("@@")(ts_query))
+        after = decode_cursor(cursor, float)
+        if after is not None:
+            sql_query = sql_query.filter(or_(rank < after[0], and_(rank == after[0], Post.id < after[1])))
+        rows = sql_query.order_by(rank.desc(), Post.id.desc()).limit(limit + 1).all()
+        next_cursor = encode_cursor(rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+        return [(post_id, highlight) for post_id, _, highlight in rows[:limit]], next_cursor
+
+    @staticmethod
+    def ensure_postgres_indexes(connection) -> None:
+        connection.execute(text(
+            "ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS "
+            f"(to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce(content, ''))) STORED"
+        ))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_posts_search_vector ON posts USING gin (search_vector) "
+            "WHERE original_post_id IS NULL"
+        ))
+
+
+class MemoryPostSearch(PostSearch):
+    # In-process inverted index for non-Postgres deployments: term -> {post id: term frequency}.
+    # All query words must match; the score is their frequency relative to the post's length.
+    def __init__(self, post_model):
+        self.Post = post_model
+        self._postings: Dict[str, Dict[int, int]] = {}
+        # post id -> (word count, distinct terms), for scoring and removal
+        self._documents: Dict[int, Tuple[int, Set[str]]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, rows: Iterable[Tuple[int, str]]) -> None:
+        for post_id, content in rows:
+            self.index(post_id, content)
+
+    def index(self, post_id: int, content: str) -> None:
+        terms = tokenize(content)
+        with self._lock:
+            self._remove(post_id)
+            self._documents[post_id] = (len(terms), set(terms))
+            for term in terms:
+                postings = self._postings.setdefault(term, {})
+                postings[post_id] = postings.get(post_id, 0) + 1
+
+    def remove(self, post_id: int) -> None:
+        with self._lock:
+            self._remove(post_id)
+
+    def search(self, db: Session, query: str, limit: int, cursor: Optional[str] = None) -> Tuple[List[Tuple[int, str]], Optional[str]]:
+        terms = set(tokenize(query))
+        if not terms:
+            return [], None
+        with self._lock:
+            postings = [self._postings.get(term, {}) for term in terms]
+            postings.sort(key=len)
+            ranked = []
+            for post_id in postings[0]:
+                if all(post_id in other for other in postings[1:]):
+                    score = sum(other[post_id] for other in postings) / self._documents[post_id][0]
+                    ranked.append((score, post_id))
+        ranked.sort(key=lambda item: (-item[0], -item[1]))
+        after = decode_cursor(cursor, float)
+        if after is not None:
+            ranked = [item for item in ranked if (-item[0], -item[1]) > (-after[0], -after[1])]
+        next_cursor = encode_cursor(*ranked[limit - 1]) if len(ranked) > limit else None
+        page_ids = [post_id for _, post_id in ranked[:limit]]
+        contents = dict(db.query(self.Post.id, self.Post.content).filter(self.Post.id.in_(page_ids))) if page_ids else {}
+        return [(post_id, self.highlight(contents.get(post_id) or "", terms)) for post_id in page_ids], next_cursor
+
+    @staticmethod
+    def highlight(content: str, terms: Set[str]) -> str:
+        # Escaped around and inside the marks, so the result is safe to render as HTML
+        parts = []
+        position = 0
+        for match in WORD_RE.finditer(content):
+            if match.group().lower() in terms:
+                parts.append(html.escape(content[position:match.start()]))
+                parts.append(f"{HIGHLIGHT_START}{html.escape(match.group())}{HIGHLIGHT_STOP}")
+                position = match.end()
+        parts.append(html.escape(content[position:]))
+        return "".join(parts)
+
+    def _remove(self, post_id: int) -> None:
+        document = self._documents.pop(post_id, None)
+        if document is None:
+            return
+        for term in document[1]:
+            postings = self._postings[term]
+            del postings[post_id]
+            if not postings:
+                del self._postings[term]
+
+
+def create_post_search(backend: str, dialect: str, post_model) -> PostSearch:
+    if backend == "auto":
+        backend = "sql" if dialect == "postgresql" else "memory"
+    if backend == "sql":
+        return SqlPostSearch(post_model)
+    if backend == "memory":
+        return MemoryPostSearch(post_model)
+    raise ValueError(f"Unknown search backend: {backend}")
+
+
+def create_user_search(backend: str, dialect: str, user_model, min_length: int) -> UserSearch:
+    if backend == "auto":
+        backend = "sql" if dialect == "postgresql" else "memory"
+    if backend == "sql":
+        return SqlUserSearch(user_model)
+    if backend == "memory":
+        return MemoryUserSearch(min_length)
+    raise ValueError(f"Unknown search backend: {backend}")
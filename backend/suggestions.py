@@ -0,0 +1,64 @@
+import heapq
+import random
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from caches import TTLCache
+
+# A conversation partner in common counts for more than having posted recently
+SHARED_PARTNER_WEIGHT = 1.0
+RECENT_ACTIVITY_WEIGHT = 0.5
+
+
+def score_candidates(
+    user_id: int,
+    partner_ids: Set[int],
+    partner_links: Iterable[Tuple[int, int]],
+    recent_authors: List[int],
+) -> Dict[int, float]:
+    # partner_links are conversations (user_a_id, user_b_id) that involve at least one partner.
+    # recent_authors is ordered most recent first; earlier authors score higher.
+    scores: Dict[int, float] = defaultdict(float)
+    for user_a_id, user_b_id in partner_links:
+        for candidate, via in ((user_a_id, user_b_id), (user_b_id, user_a_id)):
+            if via in partner_ids and candidate != user_id and candidate not in partner_ids:
+                scores[candidate] += SHARED_PARTNER_WEIGHT
+    for rank, author_id in enumerate(recent_authors):
+        if author_id != user_id and author_id not in partner_ids:
+            scores[author_id] += RECENT_ACTIVITY_WEIGHT * (1 - rank / len(recent_authors))
+    return scores
+
+
+class SuggestionPools:
+    # Precomputed, bounded candidate pools per user. Requests only read a pool and ask for it to be
+    # refreshed; the background task computes pools for the users who asked since the last cycle.
+    def __init__(self, pool_size: int = 200, max_users: int = 10000, ttl: float = 900.0):
+        self.pool_size = pool_size
+        self._pools = TTLCache(max_users, ttl)
+        self._wanted: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[List[Tuple[int, float]]]:
+        return self._pools.get(user_id)
+
+    def want(self, user_id: int) -> None:
+        with self._lock:
+            self._wanted.add(user_id)
+
+    def take_wanted(self) -> Set[int]:
+        with self._lock:
+            wanted, self._wanted = self._wanted, set()
+        return wanted
+
+    def set(self, user_id: int, scores: Dict[int, float]) -> None:
+        self._pools.set(user_id, heapq.nlargest(self.pool_size, scores.items(), key=lambda item: item[1]))
+
+    def stats(self) -> Dict[str, int]:
+        return self._pools.stats()
+
+    @staticmethod
+    def sample(pool: List[Tuple[int, float]], count: int) -> List[int]:
+        # Weighted sampling without replacement (Efraimidis-Spirakis), so suggestions vary between calls
+        picked = heapq.nlargest(count, pool, key=lambda item: random.random() ** (1 / item[1]))
+        return [user_id for user_id, _ in picked]
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from timeline import MemoryTimelineStore, RedisTimelineStore
+
+KEY = "home"
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request):
+    if request.param == "memory":
+        return MemoryTimelineStore(max_length=3)
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisTimelineStore(fakeredis.FakeAsyncRedis(), max_length=3)
+
+
+def test_short_fill_is_complete(store):
+    async def scenario():
+        await store.fill(KEY, [2, 1])
+        assert await store.page(KEY, None, 10) == [2, 1]
+        assert not await store.trimmed(KEY)
+
+    asyncio.run(scenario())
+
+
+def test_full_fill_is_trimmed(store):
+    async def scenario():
+        await store.fill(KEY, [5, 4, 3])
+        assert await store.trimmed(KEY)
+
+    asyncio.run(scenario())
+
+
+def test_push_past_max_length_then_remove_stays_trimmed(store):
+    async def scenario():
+        await store.fill(KEY, [2, 1])
+        for post_id in (3, 4, 5):
+            await store.push(KEY, post_id)
+        assert await store.page(KEY, None, 10) == [5, 4, 3]
+        assert await store.trimmed(KEY)
+
+        # An unretweet leaves fewer than max_length ids, but older posts are still missing from the cache
+        await store.remove(KEY, 4)
+        assert await store.page(KEY, None, 10) == [5, 3]
+        assert await store.trimmed(KEY)
+        assert await store.page(KEY, 3, 10) == []
+
+    asyncio.run(scenario())
+
+
+def test_push_older_than_trimmed_tail_is_ignored(store):
+    async def scenario():
+        await store.fill(KEY, [5, 4, 3])
+        await store.push(KEY, 1)
+        assert await store.page(KEY, None, 10) == [5, 4, 3]
+
+    asyncio.run(scenario())
+
+
+def test_drop_makes_timeline_cold(store):
+    async def scenario():
+        await store.fill(KEY, [5, 4, 3])
+        await store.drop(KEY)
+        assert await store.page(KEY, None, 10) is None
+        await store.push(KEY, 6)
+        assert await store.page(KEY, None, 10) is None
+        assert not await store.trimmed(KEY)
+
+    asyncio.run(scenario())
+
+
+def test_fill_keeps_posts_pushed_after_another_fill(store):
+    async def scenario():
+        await store.fill(KEY, [2, 1])
+        await store.push(KEY, 3)
+        # A second worker's fill loaded its snapshot before post 3 was committed
+        await store.fill(KEY, [2, 1])
+        assert await store.page(KEY, None, 10) == [3, 2, 1]
+        assert not await store.trimmed(KEY)
+
+    asyncio.run(scenario())
+
+
+def test_stale_fill_does_not_untrim(store):
+    async def scenario():
+        await store.fill(KEY, [2, 1])
+        for post_id in (3, 4, 5):
+            await store.push(KEY, post_id)
+        await store.fill(KEY, [2, 1])
+        assert await store.page(KEY, None, 10) == [5, 4, 3]
+        assert await store.trimmed(KEY)
+
+    asyncio.run(scenario())
@@ -0,0 +1,159 @@
+import bisect
+from typing import Dict, List, Optional, Set
+
+
+# Timelines hold post ids, newest (highest id) first, trimmed to max_length.
+# page() returns None when a timeline is not cached so the caller can rebuild it from the database.
+# Once older ids have been trimmed away, trimmed() stays true until the timeline is refilled, so a
+# page that runs past the cached tail is completed from the database however short removals make it.
+class TimelineStore:
+    def __init__(self, max_length: int = 800):
+        self.max_length = max_length
+
+    async def push(self, key: str, post_id: int) -> None:
+        raise NotImplementedError
+
+    async def remove(self, key: str, post_id: int) -> None:
+        raise NotImplementedError
+
+    async def page(self, key: str, before_id: Optional[int], limit: int) -> Optional[List[int]]:
+        raise NotImplementedError
+
+    async def trimmed(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def fill(self, key: str, post_ids: List[int]) -> None:
+        raise NotImplementedError
+
+    async def drop(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class MemoryTimelineStore(TimelineStore):
+    # Lists are only changed from the event loop, between awaits, so they need no lock
+    def __init__(self, max_length: int = 800):
+        super().__init__(max_length)
+        # Ids are kept ascending so bisect can be used directly; reads reverse the slice
+        self._timelines: Dict[str, List[int]] = {}
+        self._trimmed: Set[str] = set()
+
+    async def push(self, key: str, post_id: int) -> None:
+        timeline = self._timelines.get(key)
+        if timeline is None:
+            # Cold timelines are rebuilt on the next read
+            return
+        index = bisect.bisect_left(timeline, post_id)
+        if index < len(timeline) and timeline[index] == post_id:
+            return
+        if index == 0 and key in self._trimmed:
+            # Older than the cached tail, which is read from the database anyway
+            return
+        timeline.insert(index, post_id)
+        if len(timeline) > self.max_length:
+            del timeline[:len(timeline) - self.max_length]
+            self._trimmed.add(key)
+
+    async def remove(self, key: str, post_id: int) -> None:
+        timeline = self._timelines.get(key)
+        if timeline is None:
+            return
+        index = bisect.bisect_left(timeline, post_id)
+        if index < len(timeline) and timeline[index] == post_id:
+            del timeline[index]
+
+    async def page(self, key: str, before_id: Optional[int], limit: int) -> Optional[List[int]]:
+        timeline = self._timelines.get(key)
+        if timeline is None:
+            return None
+        end = len(timeline) if before_id is None else bisect.bisect_left(timeline, before_id)
+        return timeline[max(0, end - limit):end][::-1]
+
+    async def trimmed(self, key: str) -> bool:
+        return key in self._trimmed
+
+    async def fill(self, key: str, post_ids: List[int]) -> None:
+        # Merged into anything pushed since another fill, rather than replacing it. A full-length
+        # snapshot may have left older posts out.
+        timeline = sorted(set(self._timelines.get(key, ())) | set(post_ids))
+        self._timelines[key] = timeline[-self.max_length:]
+        if len(set(post_ids)) >= self.max_length or len(timeline) > self.max_length:
+            self._trimmed.add(key)
+
+    async def drop(self, key: str) -> None:
+        self._timelines.pop(key, None)
+        self._trimmed.discard(key)
+
+
+class RedisTimelineStore(TimelineStore):
+    # Each timeline is a sorted set scored by post id. A marker key tells an empty timeline apart from a
+    # cold one, and holds whether the timeline has been trimmed.
+    COMPLETE = b"complete"
+    TRIMMED = b"trimmed"
+
+    def __init__(self, redis, max_length: int = 800, prefix: str = "timeline:"):
+        super().__init__(max_length)
+        self._redis = redis
+        self._prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self._prefix}{key}"
+
+    def _marker(self, key: str) -> str:
+        return f"{self._prefix}{key}:warm"
+
+    async def push(self, key: str, post_id: int) -> None:
+        marker = await self._redis.get(self._marker(key))
+        if marker is None:
+            return
+        if marker == self.TRIMMED:
+            oldest = await self._redis.zrange(self._key(key), 0, 0)
+            if oldest and post_id < int(oldest[0]):
+                # Older than the cached tail, which is read from the database anyway
+                return
+        pipe = self._redis.pipeline()
+        pipe.zadd(self._key(key), {post_id: post_id})
+        pipe.zremrangebyrank(self._key(key), 0, -(self.max_length + 1))
+        _, removed = await pipe.execute()
+        if removed:
+            # xx: a timeline dropped in the meantime must stay cold
+            await self._redis.set(self._marker(key), self.TRIMMED, xx=True)
+
+    async def remove(self, key: str, post_id: int) -> None:
+        await self._redis.zrem(self._key(key), post_id)
+
+    async def page(self, key: str, before_id: Optional[int], limit: int) -> Optional[List[int]]:
+        upper = "+inf" if before_id is None else f"({before_id}"
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.exists(self._marker(key))
+        pipe.zrevrangebyscore(self._key(key), upper, "-inf", start=0, num=limit)
+        warm, post_ids = await pipe.execute()
+        if not warm:
+            return None
+        return [int(post_id) for post_id in post_ids]
+
+    async def trimmed(self, key: str) -> bool:
+        return await self._redis.get(self._marker(key)) == self.TRIMMED
+
+    async def fill(self, key: str, post_ids: List[int]) -> None:
+        # Merged into the sorted set, so ids other workers pushed since their own fill survive. The
+        # marker only ever goes from complete to trimmed.
+        pipe = self._redis.pipeline()
+        if post_ids:
+            pipe.zadd(self._key(key), {post_id: post_id for post_id in post_ids})
+        pipe.zremrangebyrank(self._key(key), 0, -(self.max_length + 1))
+        removed = (await pipe.execute())[-1]
+        if removed or len(set(post_ids)) >= self.max_length:
+            await self._redis.set(self._marker(key), self.TRIMMED)
+        else:
+            await self._redis.set(self._marker(key), self.COMPLETE, nx=True)
+
+    async def drop(self, key: str) -> None:
+        await self._redis.delete(self._key(key), self._marker(key))
+
+
+def create_timeline_store(backend: str, max_length: int, redis=None) -> TimelineStore:
+    if backend == "memory":
+        return MemoryTimelineStore(max_length)
+    if backend == "redis":
+        return RedisTimelineStore(redis, max_length)
+    raise ValueError(f"Unknown timeline backend: {backend}")
@@ -0,0 +1,65 @@
+import time
+from typing import Dict, Optional
+
+
+def now_ms() -> int:
+    # Milliseconds stay exact as Lua (double) numbers in the Redis script
+    return int(time.time() * 1000)
+
+
+# Versions are millisecond timestamps of the last change, forced to increase on every bump, so one
+# number serves both as an ETag component and as the Last-Modified time. A key that has never been
+# bumped (or was lost with a restart) starts at the current time, so it can't repeat an old version.
+class VersionStore:
+    async def get(self, key: str) -> int:
+        raise NotImplementedError
+
+    async def bump(self, key: str) -> int:
+        raise NotImplementedError
+
+
+class MemoryVersionStore(VersionStore):
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+
+    async def get(self, key: str) -> int:
+        return self._versions.setdefault(key, now_ms())
+
+    async def bump(self, key: str) -> int:
+        version = max(now_ms(), self._versions.get(key, 0) + 1)
+        self._versions[key] = version
+        return version
+
+
+class RedisVersionStore(VersionStore):
+    # Shared by every worker; the max-and-set runs as one script so concurrent bumps never go backwards
+    BUMP_SCRIPT = """
+        local now = tonumber(ARGV[1])
+        local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+        local version = math.max(now, current + 1)
+        redis.call('SET', KEYS[1], version)
+        return version
+    """
+
+    def __init__(self, redis, prefix: str = "version:"):
+        self._redis = redis
+        self._prefix = prefix
+        self._bump = self._redis.register_script(self.BUMP_SCRIPT)
+
+    async def get(self, key: str) -> int:
+        version: Optional[bytes] = await self._redis.get(self._prefix + key)
+        if version is not None:
+            return int(version)
+        await self._redis.set(self._prefix + key, now_ms(), nx=True)
+        return int(await self._redis.get(self._prefix + key))
+
+    async def bump(self, key: str) -> int:
+        return int(await self._bump(keys=[self._prefix + key], args=[now_ms()]))
+
+
+def create_version_store(backend: str, redis=None) -> VersionStore:
+    if backend == "memory":
+        return MemoryVersionStore()
+    if backend == "redis":
+        return RedisVersionStore(redis)
+    raise ValueError(f"Unknown version backend: {backend}")